@@ -5,13 +5,19 @@ Library surface:
 - RCSBClient: async client for count and id enumeration
 - sample_ids: sampling utilities
 - download_entries: parallel downloader for PDB/mmCIF files
+- create_session: pooled aiohttp session shareable across download batches
+- HostRateLimiter: header-driven limiter shareable across download batches
+- ConcurrencyController: AIMD in-flight limit shareable across download batches
 """
 from .rcsb_client import RCSBClient
 from .sampling import sample_ids
-from .downloader import download_entries
+from .downloader import ConcurrencyController, HostRateLimiter, create_session, download_entries
 
 __all__ = [
     "RCSBClient",
     "sample_ids",
     "download_entries",
+    "create_session",
+    "HostRateLimiter",
+    "ConcurrencyController",
 ]
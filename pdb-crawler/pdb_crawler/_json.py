@@ -0,0 +1,23 @@
+from __future__ import annotations
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize to compact UTF-8 JSON, using orjson when installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def loads(data: bytes | str) -> Any:
+    """Parse JSON, using orjson when installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
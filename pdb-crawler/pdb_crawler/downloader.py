@@ -1,18 +1,25 @@
 from __future__ import annotations
 
 import asyncio
+import math
 import os
 import random
+import re
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Callable, Iterable, List, Optional
+from typing import AbstractSet, Callable, Iterable, List, Mapping, Optional, Set
 
-import aiofiles
 import aiohttp
-from time import monotonic
+from time import monotonic, time
 
 
 DOWNLOAD_BASE = "https://files.rcsb.org/download"
+# Per-host TCP connection cap, independent of the app-level worker count
+MAX_CONNECTIONS_PER_HOST = 64
+CHUNK_SIZE = 1 << 16
+PART_SUFFIX = ".part"
+# Classic 4-character IDs and extended PDB_xxxxxxxx IDs
+_PDB_ID = re.compile(r"[0-9A-Z]{4}|PDB_[0-9A-Z]{8}")
 
 
 @dataclass
@@ -23,6 +30,7 @@ class DownloadConfig:
     backoff_base: float = 0.5
     backoff_max: float = 15.0
     initial_jitter_max: float = 0.75  # seconds
+    stale_part_seconds: float = 3600.0  # leftover .part files older than this are removed
 
 
 def _default_concurrency() -> int:
@@ -36,26 +44,218 @@ def _default_concurrency() -> int:
     return max(1, cores // 2)
 
 
+def _resolve_concurrency(concurrency: Optional[int]) -> int:
+    return max(1, int(concurrency)) if concurrency and concurrency > 0 else _default_concurrency()
+
+
+def create_session(
+    concurrency: Optional[int] = None,
+    cfg: Optional[DownloadConfig] = None,
+) -> aiohttp.ClientSession:
+    """Create a ClientSession with a pooled connector suitable for downloads.
+
+    Share one session across `download_entries` calls (and `RCSBClient`) to keep
+    connections, TLS sessions and DNS lookups alive between batches. aiohttp
+    speaks HTTP/1.1 only, so keep-alive reuse is what amortizes TLS setup here.
+    """
+    c = _resolve_concurrency(concurrency)
+    cfg = cfg or DownloadConfig()
+    timeout = aiohttp.ClientTimeout(total=cfg.timeout_seconds)
+    # `concurrency` sizes the worker pool; the connector only pools sockets, with
+    # no global cap and at most MAX_CONNECTIONS_PER_HOST per host
+    connector = aiohttp.TCPConnector(
+        limit=0,
+        limit_per_host=min(c, MAX_CONNECTIONS_PER_HOST),
+        ttl_dns_cache=300,
+        keepalive_timeout=75,
+        enable_cleanup_closed=True,
+    )
+    return aiohttp.ClientSession(timeout=timeout, connector=connector)
+
+
+class ConcurrencyController:
+    """AIMD limit on in-flight requests shared by all download workers.
+
+    Each 429 shrinks the limit by one permit (down to `minimum`); every
+    `increase_every` consecutive successes grow it by one (up to `maximum`).
+    Per-request exponential backoff still applies on top of this. `initial`
+    defaults to the same auto concurrency as `download_entries`.
+    """
+
+    def __init__(self, initial: Optional[int] = None, maximum: Optional[int] = None, minimum: int = 1, increase_every: int = 20) -> None:
+        initial = _resolve_concurrency(initial)
+        self._sem = asyncio.Semaphore(initial)
+        self._limit = initial
+        self._max = max(initial, maximum or initial)
+        self._min = max(1, minimum)
+        self._increase_every = max(1, increase_every)
+        self._successes = 0
+        # Permits to retire on release after the limit was reduced while they were held
+        self._debt = 0
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    async def __aenter__(self) -> "ConcurrencyController":
+        await self._sem.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self._release()
+
+    def _release(self) -> None:
+        if self._debt > 0:
+            self._debt -= 1
+        else:
+            self._sem.release()
+
+    def on_success(self) -> None:
+        self._successes += 1
+        if self._successes >= self._increase_every and self._limit < self._max:
+            self._successes = 0
+            self._limit += 1
+            self._release()
+
+    def on_throttle(self) -> None:
+        self._successes = 0
+        if self._limit > self._min:
+            self._limit -= 1
+            self._debt += 1
+
+
+def _header_float(value: Optional[str]) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        parsed = float(value)
+    except ValueError:
+        return None
+    # float() accepts "inf"/"nan", which are meaningless as rate-limit values
+    return parsed if math.isfinite(parsed) else None
+
+
+class HostRateLimiter:
+    """Proactive limiter for one host, driven by its rate-limit response headers.
+
+    Tracks `X-RateLimit-Remaining`/`X-RateLimit-Reset` and `Retry-After`. While the
+    remaining budget is at or below `low_watermark`, callers are spaced evenly over
+    the time left in the window; after a `Retry-After`, all callers wait it out.
+    """
+
+    def __init__(self, low_watermark: int = 5, max_delay: float = 60.0) -> None:
+        self._low_watermark = low_watermark
+        self._max_delay = max_delay
+        self._remaining: Optional[int] = None
+        self._reset_at = 0.0
+        self._blocked_until = 0.0
+        self._next_slot = 0.0
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        now = monotonic()
+        remaining = _header_float(headers.get("X-RateLimit-Remaining"))
+        if remaining is not None:
+            self._remaining = max(0, int(remaining))
+        reset = _header_float(headers.get("X-RateLimit-Reset"))
+        if reset is not None:
+            # Either seconds until reset or an epoch timestamp
+            delta = reset - time() if reset > 1e9 else reset
+            self._reset_at = now + min(self._max_delay, max(0.0, delta))
+        retry_after = _header_float(headers.get("Retry-After"))
+        if retry_after is not None:
+            self._blocked_until = max(self._blocked_until, now + min(self._max_delay, retry_after))
+
+    async def acquire(self) -> None:
+        now = monotonic()
+        wait_until = self._blocked_until
+        remaining = self._remaining
+        if remaining is not None and remaining <= self._low_watermark and self._reset_at > now:
+            if remaining == 0:
+                wait_until = max(wait_until, self._reset_at)
+            else:
+                slot = max(now, self._next_slot)
+                self._next_slot = slot + (self._reset_at - now) / remaining
+                wait_until = max(wait_until, slot)
+        if wait_until > now:
+            await asyncio.sleep(wait_until - now)
+
+
 async def _sleep_with_jitter(base: float) -> None:
     jitter = base * 0.1 * random.random()
     await asyncio.sleep(base + jitter)
 
 
+def _shard_key(entry_id: str) -> tuple[str, str]:
+    return (entry_id[1:3].upper(), entry_id)
+
+
+def _scan_existing(out_dir: Path, wanted: AbstractSet[str], stale_part_seconds: float) -> Set[str]:
+    """Return which `wanted` names are already non-empty files in out_dir.
+
+    One directory listing; only wanted files and `.part` files are stat'ed, so
+    the cost does not grow with unrelated files already in out_dir. Leftover
+    `.part` files from interrupted runs are deleted once older than
+    `stale_part_seconds`.
+    """
+    existing: Set[str] = set()
+    cutoff = time() - stale_part_seconds
+    try:
+        with os.scandir(out_dir) as it:
+            for e in it:
+                name = e.name
+                is_part = name.endswith(PART_SUFFIX)
+                if not (is_part or name in wanted) or not e.is_file():
+                    continue
+                st = e.stat()
+                if is_part:
+                    if st.st_mtime < cutoff:
+                        try:
+                            os.unlink(e.path)
+                        except FileNotFoundError:
+                            pass
+                elif st.st_size > 0:
+                    existing.add(name)
+    except FileNotFoundError:
+        pass
+    return existing
+
+
+async def _stream_to_file(resp: aiohttp.ClientResponse, target: Path) -> int:
+    """Write the response body to `target` chunk by chunk and return its size.
+
+    Data goes to a sibling `.part` file that is atomically renamed onto `target`
+    once complete, so an interrupted transfer never looks like a finished file.
+    """
+    loop = asyncio.get_running_loop()
+    tmp = target.with_name(target.name + PART_SUFFIX)
+    f = await loop.run_in_executor(None, tmp.open, "wb")
+    size = 0
+    try:
+        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+            await loop.run_in_executor(None, f.write, chunk)
+            size += len(chunk)
+        await loop.run_in_executor(None, f.close)
+        os.replace(tmp, target)
+    except BaseException:
+        f.close()
+        tmp.unlink(missing_ok=True)
+        raise
+    return size
+
+
 async def _download_one(
     session: aiohttp.ClientSession,
-    out_dir: Path,
     entry_id: str,
-    file_format: str,
+    url: str,
+    target: Path,
     cfg: DownloadConfig,
-    sem: asyncio.Semaphore,
+    controller: ConcurrencyController,
+    limiter: HostRateLimiter,
+    existing: AbstractSet[str],
     on_event: Optional[Callable[[dict], None]],
 ) -> Optional[Path]:
-    ext = "cif" if file_format.lower() == "cif" else "pdb"
-    url = f"{cfg.base_url}/{entry_id}.{ext}"
-    target = out_dir / f"{entry_id}.{ext}"
-
     # Skip if exists
-    if target.exists() and target.stat().st_size > 0:
+    if target.name in existing:
         if on_event is not None:
             on_event({
                 "event": "download_skip",
@@ -65,102 +265,102 @@ async def _download_one(
             })
         return target
 
-    async with sem:
-        start_ts = monotonic()
-        attempt = 0
-        last_error: Optional[dict] = None
-        while True:
-            try:
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        data = await resp.read()
-                        target.parent.mkdir(parents=True, exist_ok=True)
-                        async with aiofiles.open(target, "wb") as f:
-                            await f.write(data)
-                        if on_event is not None:
-                            on_event({
-                                "event": "download_ok",
-                                "id": entry_id,
-                                "path": str(target),
-                                "size_bytes": len(data),
-                                "attempts": attempt + 1,
-                                "elapsed_ms": int((monotonic() - start_ts) * 1000)
-                            })
-                        return target
-
-                    if resp.status == 429:
-                        retry_after = resp.headers.get("Retry-After")
-                        if retry_after:
-                            try:
-                                delay = min(cfg.backoff_max, float(retry_after))
-                            except ValueError:
-                                delay = min(cfg.backoff_max, cfg.backoff_base * (2 ** attempt))
-                        else:
-                            delay = min(cfg.backoff_max, cfg.backoff_base * (2 ** attempt))
-                        last_error = {"status": resp.status, "reason": "rate_limited"}
-                        await _sleep_with_jitter(delay)
-                        attempt += 1
-                        if attempt > cfg.max_retries:
-                            if on_event is not None:
-                                on_event({
-                                    "event": "download_error",
-                                    "id": entry_id,
-                                    "path": str(target),
-                                    "status": resp.status,
-                                    "reason": "rate_limited",
-                                    "attempts": attempt,
-                                    "elapsed_ms": int((monotonic() - start_ts) * 1000)
-                                })
-                            return None
-                        continue
-
-                    if 500 <= resp.status < 600:
-                        # Server error, backoff and retry
-                        delay = min(cfg.backoff_max, cfg.backoff_base * (2 ** attempt))
-                        last_error = {"status": resp.status, "reason": "server_error"}
-                        await _sleep_with_jitter(delay)
-                        attempt += 1
-                        if attempt > cfg.max_retries:
-                            if on_event is not None:
-                                on_event({
-                                    "event": "download_error",
-                                    "id": entry_id,
-                                    "path": str(target),
-                                    "status": resp.status,
-                                    "reason": "server_error",
-                                    "attempts": attempt,
-                                    "elapsed_ms": int((monotonic() - start_ts) * 1000)
-                                })
-                            return None
-                        continue
-
-                    # 4xx other than 429 or any unexpected
-                    if on_event is not None:
-                        on_event({
-                            "event": "download_error",
-                            "id": entry_id,
-                            "path": str(target),
-                            "status": resp.status,
-                            "reason": "client_error",
-                            "attempts": attempt + 1,
-                            "elapsed_ms": int((monotonic() - start_ts) * 1000)
-                        })
-                    return None
-            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-                if attempt >= cfg.max_retries:
+    start_ts = monotonic()
+    attempt = 0
+    last_error: Optional[dict] = None
+    while True:
+        try:
+            await limiter.acquire()
+            async with controller, session.get(url) as resp:
+                limiter.update(resp.headers)
+                if resp.status == 200:
+                    controller.on_success()
+                    size = await _stream_to_file(resp, target)
                     if on_event is not None:
                         on_event({
-                            "event": "download_error",
+                            "event": "download_ok",
                             "id": entry_id,
                             "path": str(target),
-                            "reason": type(e).__name__,
+                            "size_bytes": size,
                             "attempts": attempt + 1,
                             "elapsed_ms": int((monotonic() - start_ts) * 1000)
                         })
-                    return None
-                delay = min(cfg.backoff_max, cfg.backoff_base * (2 ** attempt))
-                await _sleep_with_jitter(delay)
-                attempt += 1
+                    return target
+
+                if resp.status == 429:
+                    controller.on_throttle()
+                    retry_after = resp.headers.get("Retry-After")
+                    if retry_after:
+                        try:
+                            delay = min(cfg.backoff_max, float(retry_after))
+                        except ValueError:
+                            delay = min(cfg.backoff_max, cfg.backoff_base * (2 ** attempt))
+                    else:
+                        delay = min(cfg.backoff_max, cfg.backoff_base * (2 ** attempt))
+                    last_error = {"status": resp.status, "reason": "rate_limited"}
+                    await _sleep_with_jitter(delay)
+                    attempt += 1
+                    if attempt > cfg.max_retries:
+                        if on_event is not None:
+                            on_event({
+                                "event": "download_error",
+                                "id": entry_id,
+                                "path": str(target),
+                                "status": resp.status,
+                                "reason": "rate_limited",
+                                "attempts": attempt,
+                                "elapsed_ms": int((monotonic() - start_ts) * 1000)
+                            })
+                        return None
+                    continue
+
+                if 500 <= resp.status < 600:
+                    # Server error, backoff and retry
+                    delay = min(cfg.backoff_max, cfg.backoff_base * (2 ** attempt))
+                    last_error = {"status": resp.status, "reason": "server_error"}
+                    await _sleep_with_jitter(delay)
+                    attempt += 1
+                    if attempt > cfg.max_retries:
+                        if on_event is not None:
+                            on_event({
+                                "event": "download_error",
+                                "id": entry_id,
+                                "path": str(target),
+                                "status": resp.status,
+                                "reason": "server_error",
+                                "attempts": attempt,
+                                "elapsed_ms": int((monotonic() - start_ts) * 1000)
+                            })
+                        return None
+                    continue
+
+                # 4xx other than 429 or any unexpected
+                if on_event is not None:
+                    on_event({
+                        "event": "download_error",
+                        "id": entry_id,
+                        "path": str(target),
+                        "status": resp.status,
+                        "reason": "client_error",
+                        "attempts": attempt + 1,
+                        "elapsed_ms": int((monotonic() - start_ts) * 1000)
+                    })
+                return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt >= cfg.max_retries:
+                if on_event is not None:
+                    on_event({
+                        "event": "download_error",
+                        "id": entry_id,
+                        "path": str(target),
+                        "reason": type(e).__name__,
+                        "attempts": attempt + 1,
+                        "elapsed_ms": int((monotonic() - start_ts) * 1000)
+                    })
+                return None
+            delay = min(cfg.backoff_max, cfg.backoff_base * (2 ** attempt))
+            await _sleep_with_jitter(delay)
+            attempt += 1
 
 
 async def download_entries(
@@ -170,37 +370,95 @@ async def download_entries(
     concurrency: Optional[int] = None,
     cfg: Optional[DownloadConfig] = None,
     on_event: Optional[Callable[[dict], None]] = None,
+    session: Optional[aiohttp.ClientSession] = None,
+    limiter: Optional[HostRateLimiter] = None,
+    controller: Optional[ConcurrencyController] = None,
 ) -> List[Path]:
     """Download files for given IDs in parallel.
 
+    If `session` is given it is used as-is and left open; otherwise a session is
+    created for this call and closed on return. Pass the same `limiter` and
+    `controller` alongside a shared session so rate-limit state and the learned
+    concurrency limit carry over between calls.
+
     Returns list of successfully written file paths.
     """
-    ids = [i.strip() for i in entry_ids if i and i.strip()]
-    if not ids:
-        return []
-
     fmt = file_format.lower()
     if fmt not in {"cif", "pdb"}:
         raise ValueError("file_format must be 'cif' or 'pdb'")
 
-    c = max(1, int(concurrency)) if concurrency and concurrency > 0 else _default_concurrency()
+    # Normalize and de-duplicate (order-preserving) before anything hits the network
+    ids = list(dict.fromkeys(i.strip().upper() for i in entry_ids if i and i.strip()))
+    invalid = [i for i in ids if not _PDB_ID.fullmatch(i)]
+    if invalid:
+        ids = [i for i in ids if _PDB_ID.fullmatch(i)]
+        if on_event is not None:
+            for eid in invalid:
+                on_event({
+                    "event": "download_skip_invalid",
+                    "id": eid,
+                    "reason": "invalid_id"
+                })
+    if not ids:
+        return []
+    # Group by RCSB's middle-two-character shard (e.g. 1ABC -> AB) so consecutive
+    # requests on a kept-alive connection hit the same origin/edge cache
+    ids.sort(key=_shard_key)
+
+    c = _resolve_concurrency(concurrency)
     cfg = cfg or DownloadConfig()
 
     out_path = Path(out_dir)
-    timeout = aiohttp.ClientTimeout(total=cfg.timeout_seconds)
-
-    sem = asyncio.Semaphore(c)
-    connector = aiohttp.TCPConnector(limit=c)
 
     # Initial small stagger
     initial_jitter = min(cfg.initial_jitter_max, cfg.initial_jitter_max * random.random())
 
-    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+    # Bounded worker pool: `c` long-lived consumers instead of one task per ID
+    queue: asyncio.Queue[str] = asyncio.Queue()
+    for eid in ids:
+        queue.put_nowait(eid)
+    results: List[Path] = []
+    controller = controller or ConcurrencyController(c)
+    limiter = limiter or HostRateLimiter()
+    out_path.mkdir(parents=True, exist_ok=True)
+
+    # Per-call invariants, hoisted out of the per-ID path
+    url_prefix = f"{cfg.base_url}/"
+    suffix = f".{fmt}"
+    existing = _scan_existing(out_path, {eid + suffix for eid in ids}, cfg.stale_part_seconds)
+
+    async def _worker(s: aiohttp.ClientSession) -> None:
+        while True:
+            eid = await queue.get()
+            try:
+                name = eid + suffix
+                path = await _download_one(
+                    s, eid, url_prefix + name, out_path / name, cfg, controller, limiter, existing, on_event
+                )
+                if path is not None:
+                    results.append(path)
+            finally:
+                queue.task_done()
+
+    async def _run(s: aiohttp.ClientSession) -> None:
         await asyncio.sleep(initial_jitter)
-        tasks = [
-            asyncio.create_task(_download_one(session, out_path, eid, fmt, cfg, sem, on_event))
-            for eid in ids
-        ]
-        results = await asyncio.gather(*tasks)
+        workers = [asyncio.create_task(_worker(s)) for _ in range(min(c, len(ids)))]
+        drained = asyncio.create_task(queue.join())
+        try:
+            done, _ = await asyncio.wait([drained, *workers], return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is not drained:
+                    # A worker only exits on an unexpected error; surface it
+                    task.result()
+        finally:
+            for task in (drained, *workers):
+                task.cancel()
+            await asyncio.gather(drained, *workers, return_exceptions=True)
+
+    if session is not None:
+        await _run(session)
+    else:
+        async with create_session(c, cfg) as own_session:
+            await _run(own_session)
 
-    return [p for p in results if p is not None]
+    return results
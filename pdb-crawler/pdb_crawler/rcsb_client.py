@@ -1,20 +1,23 @@
 from __future__ import annotations
 
 import asyncio
-import json
+import copy
 from dataclasses import dataclass
-from typing import AsyncIterator, Dict, Optional, Callable
+from typing import AsyncIterator, Dict, List, Optional, Callable
 
 import aiohttp
 from importlib import resources
 
+from . import _json
+
 
 SEARCH_ENDPOINT = "https://search.rcsb.org/rcsbsearch/v2/query?json"
+_JSON_HEADERS = {"Content-Type": "application/json"}
 
 
 def _load_query_json(name: str) -> Dict:
-    with resources.files("pdb_crawler.queries").joinpath(name).open("r", encoding="utf-8") as f:
-        return json.load(f)
+    with resources.files("pdb_crawler.queries").joinpath(name).open("rb") as f:
+        return _json.loads(f.read())
 
 
 @dataclass
@@ -36,6 +39,9 @@ class RCSBClient:
         self.config = config or RCSBClientConfig()
         self._external_session = session
         self._session: Optional[aiohttp.ClientSession] = None
+        # Query templates are read once per client, not once per request/page
+        self._count_payload = _load_query_json("count_all.json")
+        self._enum_payload_template = _load_query_json("enumerate_all.json")
 
     async def __aenter__(self) -> "RCSBClient":
         if self._external_session is not None:
@@ -57,12 +63,14 @@ class RCSBClient:
         return self._session
 
     async def _post_with_retry(self, payload: Dict) -> Dict:
+        # Serialize once; the same bytes are resent on retry
+        body = _json.dumps(payload)
         attempt = 0
         while True:
             try:
-                async with self.session.post(self.config.base_search_url, json=payload) as resp:
+                async with self.session.post(self.config.base_search_url, data=body, headers=_JSON_HEADERS) as resp:
                     if resp.status == 200:
-                        return await resp.json()
+                        return _json.loads(await resp.read())
                     # Handle 429 with Retry-After if present
                     if resp.status == 429:
                         retry_after = resp.headers.get("Retry-After")
@@ -100,8 +108,7 @@ class RCSBClient:
 
     async def count_entries(self) -> int:
         """Return the total count of PDB entries matching the catch-all query."""
-        payload = _load_query_json("count_all.json")
-        data = await self._post_with_retry(payload)
+        data = await self._post_with_retry(self._count_payload)
         # Try multiple possible keys for resilience
         total = data.get("total_count")
         if total is None:
@@ -114,12 +121,12 @@ class RCSBClient:
             raise RuntimeError("Unable to determine total count from RCSB response")
         return int(total)
 
-    async def enumerate_entry_ids(
+    async def enumerate_pages(
         self,
         page_size: int = 1000,
         on_page: Optional[Callable[[int, int, int, int], None]] = None,
-    ) -> AsyncIterator[str]:
-        """Yield all entry IDs using paginated search queries.
+    ) -> AsyncIterator[List[str]]:
+        """Yield entry IDs one page at a time using paginated search queries.
 
         Args:
             page_size: rows per page (RCSB permits 1000 typical; adjust if needed)
@@ -130,17 +137,18 @@ class RCSBClient:
 
         # First request to get total
         total = await self.count_entries()
+        # The body is serialized on each POST, so one copy can be mutated per page
+        payload = copy.deepcopy(self._enum_payload_template)
+        paginate = payload.setdefault("request_options", {}).setdefault("paginate", {})
         start = 0
         while start < total:
             page_number = (start // page_size) + 1
-            payload = _load_query_json("enumerate_all.json")
             # Modify pagination per page
-            payload.setdefault("request_options", {}).setdefault("paginate", {})
-            payload["request_options"]["paginate"]["start"] = start
-            payload["request_options"]["paginate"]["rows"] = min(page_size, total - start)
+            paginate["start"] = start
+            paginate["rows"] = min(page_size, total - start)
 
             if on_page is not None:
-                on_page(start, payload["request_options"]["paginate"]["rows"], page_number, total)
+                on_page(start, paginate["rows"], page_number, total)
 
             data = await self._post_with_retry(payload)
             result_set = data.get("result_set") or data.get("resultSet") or []
@@ -148,10 +156,27 @@ class RCSBClient:
                 # No more results
                 break
 
+            page: List[str] = []
             for item in result_set:
                 # Typical shape: {"identifier": "1ABC", ...}
                 ident = item.get("identifier") or item.get("entry_id") or item.get("id")
                 if isinstance(ident, str):
-                    yield ident
+                    page.append(ident)
+            yield page
 
             start += page_size
+
+    async def enumerate_entry_ids(
+        self,
+        page_size: int = 1000,
+        on_page: Optional[Callable[[int, int, int, int], None]] = None,
+    ) -> AsyncIterator[str]:
+        """Yield all entry IDs using paginated search queries.
+
+        Args:
+            page_size: rows per page (RCSB permits 1000 typical; adjust if needed)
+            on_page: optional callback called per page with (start, rows, page_number, total)
+        """
+        async for page in self.enumerate_pages(page_size=page_size, on_page=on_page):
+            for ident in page:
+                yield ident
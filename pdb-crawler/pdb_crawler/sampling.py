@@ -2,33 +2,60 @@ from __future__ import annotations
 
 import math
 import random
+import secrets
 from typing import Iterable, List, Optional, Sequence
 
 
+def make_rng(seed: Optional[int] = None) -> random.Random:
+    """Return a PRNG: deterministic for a given seed, else seeded from 256 bits of OS entropy.
+
+    Unlike SystemRandom, the unseeded generator costs no syscall per draw.
+    """
+    return random.Random(seed if seed is not None else secrets.randbits(256))
+
+
+def sample_size(n: int, percent: float) -> int:
+    """Return how many of n IDs `sample_ids` picks for percent (0 if none)."""
+    p = max(0.0, min(100.0, float(percent)))
+    if n <= 0 or p <= 0.0:
+        return 0
+    k = math.floor(n * (p / 100.0))
+    return max(1, min(n, k))
+
+
 def sample_ids(ids: Sequence[str], percent: float, seed: Optional[int] = None) -> List[str]:
     """Return a random sample of IDs sized by percent.
 
     - If seed is provided, uses deterministic PRNG for reproducibility.
-    - If seed is None, uses SystemRandom for higher-quality randomness.
+    - If seed is None, uses a PRNG seeded from 256 bits of OS entropy (see make_rng).
     - Sampling is without replacement.
     - Percent is clamped to [0, 100].
     """
-    if not ids:
+    n = len(ids)
+    k = sample_size(n, percent)
+    if k == 0:
         return []
 
-    p = max(0.0, min(100.0, float(percent)))
-    if p <= 0.0:
-        return []
+    rng = make_rng(seed)
 
-    n = len(ids)
-    k = math.floor(n * (p / 100.0))
-    k = max(1, min(n, k))
+    # If k close to n, shuffle and slice is efficient
+    if k >= n // 2:
+        pool = list(ids)
+        rng.shuffle(pool)
+        return pool[:k]
+    # Otherwise a partial Fisher-Yates draw touches only O(k) items
+    return rng.sample(ids, k)
 
-    # Work on a copy
-    pool = list(ids)
 
-    rng = random.Random(seed) if seed is not None else random.SystemRandom()
+def draw_ids(pool: List[str], k: int, rng: random.Random) -> List[str]:
+    """Remove and return up to k random IDs from pool, in O(k).
 
-    # If k close to n, shuffle and slice is efficient
-    rng.shuffle(pool)
-    return pool[:k]
+    Swap-and-pop keeps the remaining pool valid for later draws, so repeated
+    top-ups never rescan or reshuffle the whole universe.
+    """
+    drawn: List[str] = []
+    for _ in range(min(k, len(pool))):
+        j = rng.randrange(len(pool))
+        pool[j], pool[-1] = pool[-1], pool[j]
+        drawn.append(pool.pop())
+    return drawn